@@ -1,15 +1,29 @@
+import atexit
+import gzip
+import brotli
 import hashlib
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
+import random
 import re
+import sys
 import unicodedata
-from collections import deque, OrderedDict
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
 import threading
 import time
 from bs4 import BeautifulSoup
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+import orjson
+from urllib3.util.retry import Retry
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # ─── LOGGING ────────────────────────────────────────────────
 _log_handlers = [logging.StreamHandler()]
@@ -19,14 +33,79 @@ if _log_dir:
     _log_file = os.path.join(_log_dir, 'app.log')
     _log_handlers.append(RotatingFileHandler(_log_file, maxBytes=5 * 1024 * 1024, backupCount=3))
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(name)s: %(message)s',
-    handlers=_log_handlers,
-)
+_log_formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+# Request threads only enqueue records; a background listener thread does the
+# actual (blocking) stream/file writes, including log rotation.
+_log_queue = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+_log_listener.start()
+
+def _stop_log_listener():
+    _log_listener.stop()
+
+atexit.register(_stop_log_listener)
+
+# The real handlers apply the full format; the queue side only renders the
+# message (and traceback) so records survive being handed across threads.
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+
+def _restart_log_listener():
+    # Forked workers (gunicorn --preload) don't inherit the listener thread, and
+    # the inherited queue's lock may have been held mid-fork; start fresh.
+    global _log_queue, _log_listener
+    _log_queue = queue.Queue(-1)
+    _queue_handler.queue = _log_queue
+    _log_listener = QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+    _log_listener.start()
+
+os.register_at_fork(after_in_child=_restart_log_listener)
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Encode responses and parse request bodies with orjson instead of the stdlib."""
+
+    def dumps(self, obj, *, default=None, sort_keys=False, **kwargs):
+        if kwargs:
+            raise TypeError(f"Unsupported json.dumps argument(s) for orjson: {', '.join(kwargs)}")
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            raise TypeError(f"Unsupported json.loads argument(s) for orjson: {', '.join(kwargs)}")
+        # orjson.JSONDecodeError subclasses ValueError, so get_json() handles it as before
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Same argument rules as jsonify(): one value, several (a list), or keywords (a dict)
+        if args and kwargs:
+            raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+        if not args and not kwargs:
+            obj = None
+        elif kwargs:
+            obj = kwargs
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args)
+        # Hand orjson's bytes straight to the response, skipping a str round-trip
+        return self._app.response_class(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype=self.mimetype)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Behind a reverse proxy (e.g. Cloud Run's front end) remote_addr is the proxy;
+# trust that many X-Forwarded-For hops so rate limiting sees the client IP.
+_TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+if _TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=_TRUSTED_PROXY_HOPS)
 
 # ─── RESPONSE CACHE ──────────────────────────────────────
 _RESPONSE_CACHE_TTL = 3600       # 1 hour
@@ -34,9 +113,16 @@ _RESPONSE_CACHE_MAX = 500
 _response_cache: 'OrderedDict[str, tuple]' = OrderedDict()
 _response_cache_lock = threading.Lock()
 
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def _normalize_prompt(text: str) -> str:
+    """Canonicalize a prompt so trivially different phrasings share a cache entry."""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return _WHITESPACE_RE.sub(' ', text).strip().rstrip('?!. ')
+
 def _cache_key(system: str, user: str) -> str:
     import json
-    return hashlib.sha256(json.dumps([system, user], ensure_ascii=False).encode()).hexdigest()
+    return hashlib.sha256(json.dumps([system, _normalize_prompt(user)], ensure_ascii=False).encode()).hexdigest()
 
 def _response_cache_get(key: str):
     with _response_cache_lock:
@@ -64,21 +150,32 @@ _RATE_LIMIT_MAX = 20
 _RATE_LIMIT_WINDOW = 60          # seconds
 _rate_limit_store: 'dict[str, deque]' = {}
 _rate_limit_lock = threading.Lock()
+_rate_limit_last_sweep = 0.0
 
-def _is_rate_limited(ip: str) -> bool:
+def _sweep_rate_limit_store(now, cutoff):
+    # Once per window, forget IPs with no requests inside it
+    global _rate_limit_last_sweep
+    if now - _rate_limit_last_sweep < _RATE_LIMIT_WINDOW:
+        return
+    for ip in [ip for ip, q in _rate_limit_store.items() if not q or q[-1] < cutoff]:
+        del _rate_limit_store[ip]
+    _rate_limit_last_sweep = now
+
+def _is_rate_limited(ip: str, cost: int = 1) -> bool:
+    """Record cost requests for ip, unless that would exceed the limit."""
     now = time.time()
     cutoff = now - _RATE_LIMIT_WINDOW
     with _rate_limit_lock:
-        q = _rate_limit_store.setdefault(ip, deque())
+        _sweep_rate_limit_store(now, cutoff)
+        q = _rate_limit_store.get(ip) or deque()
         # Drop timestamps outside the window
         while q and q[0] < cutoff:
             q.popleft()
-        # Clean up empty deques for inactive IPs
-        if len(q) == 0:
-            del _rate_limit_store[ip]
-        if len(q) >= _RATE_LIMIT_MAX:
+        if len(q) + cost > _RATE_LIMIT_MAX:
             return True
-        q.append(now)
+        q.extend([now] * cost)
+        # Only stored once something is recorded, so an empty deque isn't kept
+        _rate_limit_store[ip] = q
         return False
 
 @app.before_request
@@ -107,29 +204,174 @@ def add_security_headers(response):
     response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
     return response
 
+# ─── RESPONSE COMPRESSION ─────────────────────────────────
+_COMPRESS_MIN_SIZE = 1024        # bytes; smaller bodies aren't worth the overhead
+_COMPRESS_LEVEL = 6
+
+@app.after_request
+def compress_json_response(response):
+    # LLM answers are multi-KB of text; gzip them when the client accepts it.
+    # Streamed (SSE) and already-encoded responses are left alone.
+    if (response.mimetype != 'application/json'
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or request.accept_encodings.best_match(['gzip']) != 'gzip'):
+        return response
+    data = response.get_data()
+    if len(data) < _COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=_COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+# ─── HTTP SESSION ────────────────────────────────────────
+# Shared across provider calls and blog fetches so TCP/TLS connections are
+# kept alive and reused instead of re-handshaking on every request.
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+class CircuitBreakerAdapter(HTTPAdapter):
+    """HTTPAdapter that stops calling a host for a while after repeated failures.
+
+    After fail_max consecutive failures (connection errors, timeouts, 429 or 5xx
+    once retries are exhausted) requests to that host fail immediately for
+    reset_timeout seconds. After that they are let through again, and a single
+    further failure reopens the circuit.
+    """
+
+    def __init__(self, *args, fail_max=5, reset_timeout=30, **kwargs):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = {}   # host -> (consecutive failures, time of last failure)
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        host = urlsplit(request.url).hostname
+        with self._lock:
+            failures, last = self._failures.get(host, (0, 0.0))
+        if failures >= self.fail_max and time.monotonic() - last < self.reset_timeout:
+            raise CircuitOpenError(f"Circuit open for {host}", request=request)
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            self._record(host, failed=True)
+            raise
+        self._record(host, failed=response.status_code == 429 or response.status_code >= 500)
+        return response
+
+    def _record(self, host, failed):
+        with self._lock:
+            if not failed:
+                self._failures.pop(host, None)
+                return
+            failures = self._failures.get(host, (0, 0.0))[0] + 1
+            self._failures[host] = (failures, time.monotonic())
+        if failures == self.fail_max:
+            logger.warning("Opening circuit for %s after %d consecutive failures", host, failures)
+
+
+def _mount_session_adapters():
+    _session.mount('https://', CircuitBreakerAdapter(
+        pool_connections=10,
+        pool_maxsize=50,
+        max_retries=Retry(
+            total=2,
+            backoff_factor=0.2,
+            status_forcelist=[429, 500, 502, 503, 504],
+            # Provider calls are POSTs, which urllib3 doesn't retry by default. A
+            # 429/5xx means no completion was produced, so resending is safe; a
+            # read timeout may mean one is still running, so that isn't retried.
+            allowed_methods=frozenset({'GET', 'POST'}),
+            read=False,
+            raise_on_status=False,
+        ),
+    ))
+    _session.mount('http://', HTTPAdapter())
+
+def _reset_session_after_fork():
+    # Workers forked from a preloaded master would otherwise share its pooled
+    # sockets and inherit any pool or circuit-breaker lock held mid-request.
+    # A fresh adapter resets both (and the breaker counts); the old ones are
+    # dropped without closing them, since that would take those locks.
+    _mount_session_adapters()
+
+_session = requests.Session()
+# Skip the per-request proxy/netrc environment lookup; outbound calls go direct.
+_session.trust_env = False
+_mount_session_adapters()
+os.register_at_fork(after_in_child=_reset_session_after_fork)
+
 # ─── LLM PROVIDERS ───────────────────────────────────────
+# Request bodies are encoded once per provider with named string placeholders;
+# each call only encodes the system/user text and splices it in.
+_PLACEHOLDER_RE = re.compile(rb'"\\u0000(\w+)\\u0000"')
+
+def _placeholder(name):
+    return f'\x00{name}\x00'
+
+def _compile_json_template(payload):
+    """Encode payload, splitting it into literal byte chunks and placeholder names."""
+    return _PLACEHOLDER_RE.split(orjson.dumps(payload))
+
+def _render_json_template(parts, **values):
+    out = list(parts)
+    for i in range(1, len(out), 2):
+        out[i] = orjson.dumps(values[out[i].decode()])
+    return b''.join(out)
+
+def _chat_template(model, **extra):
+    """OpenAI-style chat completions body shared by most providers."""
+    return _compile_json_template({
+        'model': model,
+        'messages': [
+            {'role': 'system', 'content': _placeholder('system')},
+            {'role': 'user', 'content': _placeholder('user')},
+        ],
+        'max_tokens': 2000,
+        'temperature': 0.6,
+        **extra,
+    })
+
+_GROQ_TEMPLATE = _chat_template('llama3-8b-8192')
+_CEREBRAS_TEMPLATE = _chat_template('llama3.1-8b')
+_MISTRAL_TEMPLATE = _chat_template('mistral-small-latest')
+_OPENROUTER_TEMPLATE = _chat_template('mistralai/mistral-7b-instruct')
+_GEMINI_TEMPLATE = _compile_json_template({
+    'systemInstruction': {'parts': [{'text': _placeholder('system')}]},
+    'contents': [{'role': 'user', 'parts': [{'text': _placeholder('user')}]}],
+    'generationConfig': {'maxOutputTokens': 2000, 'temperature': 0.6},
+})
+_COHERE_TEMPLATE = _compile_json_template({
+    'model': 'command-r-plus',
+    'preamble': _placeholder('system'),
+    'message': _placeholder('user'),
+    'max_tokens': 2000,
+    'temperature': 0.6,
+})
+_HUGGINGFACE_TEMPLATE = _compile_json_template({
+    'inputs': _placeholder('prompt'),
+    'parameters': {'max_new_tokens': 2000, 'temperature': 0.6, 'return_full_text': False},
+})
+
 
 def _llm_via_groq(system: str, user: str) -> str:
     key = os.environ.get('GROQ_KEY', '')
     if not key:
         return ''
-    payload = {
-        'model': 'llama3-8b-8192',
-        'messages': [
-            {'role': 'system', 'content': system},
-            {'role': 'user', 'content': user},
-        ],
-        'max_tokens': 2000,
-        'temperature': 0.6,
-    }
     headers = {'Authorization': f'Bearer {key}', 'Content-Type': 'application/json'}
     try:
-        r = requests.post('https://api.groq.com/openai/v1/chat/completions',
-                          headers=headers, json=payload, timeout=(5, 30))
+        body = _render_json_template(_GROQ_TEMPLATE, system=system, user=user)
+        r = _session.post('https://api.groq.com/openai/v1/chat/completions',
+                          headers=headers, data=body, timeout=(3.05, 25))
         if not r.ok:
             logger.warning("Groq returned status %s", r.status_code)
             return ''
-        return r.json()['choices'][0]['message']['content']
+        return orjson.loads(r.content)['choices'][0]['message']['content']
+    except CircuitOpenError:
+        return ''  # already logged when the circuit opened
     except Exception:
         logger.warning("Groq call failed", exc_info=True)
         return ''
@@ -139,23 +381,17 @@ def _llm_via_cerebras(system: str, user: str) -> str:
     key = os.environ.get('CEREBRAS_KEY', '')
     if not key:
         return ''
-    payload = {
-        'model': 'llama3.1-8b',
-        'messages': [
-            {'role': 'system', 'content': system},
-            {'role': 'user', 'content': user},
-        ],
-        'max_tokens': 2000,
-        'temperature': 0.6,
-    }
     headers = {'Authorization': f'Bearer {key}', 'Content-Type': 'application/json'}
     try:
-        r = requests.post('https://api.cerebras.ai/v1/chat/completions',
-                          headers=headers, json=payload, timeout=(5, 30))
+        body = _render_json_template(_CEREBRAS_TEMPLATE, system=system, user=user)
+        r = _session.post('https://api.cerebras.ai/v1/chat/completions',
+                          headers=headers, data=body, timeout=(3.05, 25))
         if not r.ok:
             logger.warning("Cerebras returned status %s", r.status_code)
             return ''
-        return r.json()['choices'][0]['message']['content']
+        return orjson.loads(r.content)['choices'][0]['message']['content']
+    except CircuitOpenError:
+        return ''  # already logged when the circuit opened
     except Exception:
         logger.warning("Cerebras call failed", exc_info=True)
         return ''
@@ -165,22 +401,21 @@ def _llm_via_gemini(system: str, user: str) -> str:
     key = os.environ.get('GEMINI_KEY', '')
     if not key:
         return ''
-    payload = {
-        'systemInstruction': {'parts': [{'text': system}]},
-        'contents': [{'role': 'user', 'parts': [{'text': user}]}],
-        'generationConfig': {'maxOutputTokens': 2000, 'temperature': 0.6},
-    }
+    headers = {'Content-Type': 'application/json'}
     url = (
         'https://generativelanguage.googleapis.com/v1beta/models/'
         f'gemini-1.5-flash:generateContent?key={key}'
     )
     try:
-        r = requests.post(url, json=payload, timeout=(5, 30))
+        body = _render_json_template(_GEMINI_TEMPLATE, system=system, user=user)
+        r = _session.post(url, headers=headers, data=body, timeout=(3.05, 25))
         if not r.ok:
             logger.warning("Gemini returned status %s", r.status_code)
             return ''
-        data = r.json()
+        data = orjson.loads(r.content)
         return data['candidates'][0]['content']['parts'][0]['text']
+    except CircuitOpenError:
+        return ''  # already logged when the circuit opened
     except Exception:
         logger.warning("Gemini call failed", exc_info=True)
         return ''
@@ -190,21 +425,17 @@ def _llm_via_cohere(system: str, user: str) -> str:
     key = os.environ.get('COHERE_KEY', '')
     if not key:
         return ''
-    payload = {
-        'model': 'command-r-plus',
-        'preamble': system,
-        'message': user,
-        'max_tokens': 2000,
-        'temperature': 0.6,
-    }
     headers = {'Authorization': f'Bearer {key}', 'Content-Type': 'application/json'}
     try:
-        r = requests.post('https://api.cohere.ai/v1/chat',
-                          headers=headers, json=payload, timeout=(5, 30))
+        body = _render_json_template(_COHERE_TEMPLATE, system=system, user=user)
+        r = _session.post('https://api.cohere.ai/v1/chat',
+                          headers=headers, data=body, timeout=(3.05, 25))
         if not r.ok:
             logger.warning("Cohere returned status %s", r.status_code)
             return ''
-        return r.json()['text']
+        return orjson.loads(r.content)['text']
+    except CircuitOpenError:
+        return ''  # already logged when the circuit opened
     except Exception:
         logger.warning("Cohere call failed", exc_info=True)
         return ''
@@ -214,23 +445,17 @@ def _llm_via_mistral(system: str, user: str) -> str:
     key = os.environ.get('MISTRAL_KEY', '')
     if not key:
         return ''
-    payload = {
-        'model': 'mistral-small-latest',
-        'messages': [
-            {'role': 'system', 'content': system},
-            {'role': 'user', 'content': user},
-        ],
-        'max_tokens': 2000,
-        'temperature': 0.6,
-    }
     headers = {'Authorization': f'Bearer {key}', 'Content-Type': 'application/json'}
     try:
-        r = requests.post('https://api.mistral.ai/v1/chat/completions',
-                          headers=headers, json=payload, timeout=(5, 30))
+        body = _render_json_template(_MISTRAL_TEMPLATE, system=system, user=user)
+        r = _session.post('https://api.mistral.ai/v1/chat/completions',
+                          headers=headers, data=body, timeout=(3.05, 25))
         if not r.ok:
             logger.warning("Mistral returned status %s", r.status_code)
             return ''
-        return r.json()['choices'][0]['message']['content']
+        return orjson.loads(r.content)['choices'][0]['message']['content']
+    except CircuitOpenError:
+        return ''  # already logged when the circuit opened
     except Exception:
         logger.warning("Mistral call failed", exc_info=True)
         return ''
@@ -240,23 +465,17 @@ def _llm_via_openrouter(system: str, user: str) -> str:
     key = os.environ.get('OPENROUTER_KEY', '')
     if not key:
         return ''
-    payload = {
-        'model': 'mistralai/mistral-7b-instruct',
-        'messages': [
-            {'role': 'system', 'content': system},
-            {'role': 'user', 'content': user},
-        ],
-        'max_tokens': 2000,
-        'temperature': 0.6,
-    }
     headers = {'Authorization': f'Bearer {key}', 'Content-Type': 'application/json'}
     try:
-        r = requests.post('https://openrouter.ai/api/v1/chat/completions',
-                          headers=headers, json=payload, timeout=(5, 30))
+        body = _render_json_template(_OPENROUTER_TEMPLATE, system=system, user=user)
+        r = _session.post('https://openrouter.ai/api/v1/chat/completions',
+                          headers=headers, data=body, timeout=(3.05, 25))
         if not r.ok:
             logger.warning("OpenRouter returned status %s", r.status_code)
             return ''
-        return r.json()['choices'][0]['message']['content']
+        return orjson.loads(r.content)['choices'][0]['message']['content']
+    except CircuitOpenError:
+        return ''  # already logged when the circuit opened
     except Exception:
         logger.warning("OpenRouter call failed", exc_info=True)
         return ''
@@ -267,23 +486,22 @@ def _llm_via_huggingface(system: str, user: str) -> str:
     if not key:
         return ''
     prompt = f"[INST] <<SYS>>\n{system}\n<</SYS>>\n\n{user} [/INST]"
-    payload = {
-        'inputs': prompt,
-        'parameters': {'max_new_tokens': 2000, 'temperature': 0.6, 'return_full_text': False},
-    }
-    headers = {'Authorization': f'Bearer {key}'}
+    headers = {'Authorization': f'Bearer {key}', 'Content-Type': 'application/json'}
     try:
-        r = requests.post(
+        body = _render_json_template(_HUGGINGFACE_TEMPLATE, prompt=prompt)
+        r = _session.post(
             'https://api-inference.huggingface.co/models/meta-llama/Llama-2-7b-chat-hf',
-            headers=headers, json=payload, timeout=(5, 30),
+            headers=headers, data=body, timeout=(3.05, 25),
         )
         if not r.ok:
             logger.warning("HuggingFace returned status %s", r.status_code)
             return ''
-        data = r.json()
+        data = orjson.loads(r.content)
         if isinstance(data, list) and data:
             return data[0].get('generated_text', '')
         return ''
+    except CircuitOpenError:
+        return ''  # already logged when the circuit opened
     except Exception:
         logger.warning("HuggingFace call failed", exc_info=True)
         return ''
@@ -299,12 +517,81 @@ _PROVIDERS = [
     _llm_via_huggingface,
 ]
 
+# OpenAI-compatible providers that can stream tokens as server-sent events,
+# in the same priority order as _PROVIDERS: (display name, key env, URL, body).
+_STREAM_PROVIDERS = [
+    ('Groq', 'GROQ_KEY', 'https://api.groq.com/openai/v1/chat/completions',
+     _chat_template('llama3-8b-8192', stream=True)),
+    ('Cerebras', 'CEREBRAS_KEY', 'https://api.cerebras.ai/v1/chat/completions',
+     _chat_template('llama3.1-8b', stream=True)),
+    ('Mistral', 'MISTRAL_KEY', 'https://api.mistral.ai/v1/chat/completions',
+     _chat_template('mistral-small-latest', stream=True)),
+    ('OpenRouter', 'OPENROUTER_KEY', 'https://openrouter.ai/api/v1/chat/completions',
+     _chat_template('mistralai/mistral-7b-instruct', stream=True)),
+]
+# The rest of the chain, for when none of the streaming providers produced any text
+_NON_STREAM_PROVIDERS = [
+    provider for provider in _PROVIDERS
+    if provider not in (_llm_via_groq, _llm_via_cerebras, _llm_via_mistral, _llm_via_openrouter)
+]
+
+def _stream_chat_completion(name, url, key, template, system, user):
+    """Yield content deltas from a streaming chat completions call."""
+    body = _render_json_template(template, system=system, user=user)
+    headers = {'Authorization': f'Bearer {key}', 'Content-Type': 'application/json'}
+    with _session.post(url, headers=headers, data=body, stream=True, timeout=(3.05, 25)) as r:
+        if not r.ok:
+            logger.warning("%s returned status %s", name, r.status_code)
+            return
+        for line in r.iter_lines():
+            if not line.startswith(b'data:'):
+                continue
+            data = line[5:].strip()
+            if data == b'[DONE]':
+                break
+            choices = orjson.loads(data).get('choices') or [{}]
+            delta = choices[0].get('delta', {}).get('content')
+            if delta:
+                yield delta
+
+class StreamInterruptedError(Exception):
+    """Raised by llm_stream when a provider fails after part of the answer was yielded."""
+
+
+def llm_stream(system: str, user: str):
+    """Yield raw answer text from the first streaming provider that produces any.
+
+    Returning normally means the answer is complete ([DONE] or a clean end of
+    stream); a failure after the first delta raises StreamInterruptedError.
+    """
+    for name, key_env, url, template in _STREAM_PROVIDERS:
+        key = os.environ.get(key_env, '')
+        if not key:
+            continue
+        produced = False
+        try:
+            for delta in _stream_chat_completion(name, url, key, template, system, user):
+                produced = True
+                yield delta
+        except CircuitOpenError:
+            continue  # raised before any output; logged when the circuit opened
+        except Exception as exc:
+            if produced:
+                logger.warning("%s stream interrupted", name, exc_info=True)
+                raise StreamInterruptedError(name) from exc
+            logger.warning("%s stream failed", name, exc_info=True)
+        # Once text has reached the client, a different provider can't take over
+        if produced:
+            return
+
 
 # ─── BACKGROUND BLOG CONTENT ─────────────────────────────
 _blog_cache = {"content": "", "last": 0}
 _blog_cache_lock = threading.Lock()
 _refresh_thread_started = False
 _refresh_thread_lock = threading.Lock()
+_refresh_event = threading.Event()
+_refresh_stop = threading.Event()
 
 FALLBACK = """
 [TAX] Rideshare tax forms are released at the end of January. 1099-K, 1099-NEC required.
@@ -322,34 +609,84 @@ Get a US number without SSN using Google Voice.
 [FLIGHTS] International flights from NJ $400-700. Pay excess baggage 24 hours before flight for cheaper rate.
 """
 
+_BLOG_CONTEXT_MAX = 6000         # characters of blog text kept as reference data
+_BLOG_REFRESH_INTERVAL = 3600    # 1 hour
+_BLOG_REFRESH_JITTER = 600       # +/- seconds, so instances don't refresh in lockstep
+_POST_CLASS_RE = re.compile(r"post", re.I)
+
+# Per-URL validators and extracted snippets from the last 200 response, so an
+# unchanged page (304 Not Modified) can be reused without re-parsing it.
+# Only touched by blog refresh workers, each of which owns a single URL's key.
+_blog_pages = {}
+
+_BLOG_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Referer": "https://www.google.com/"
+}
+_BLOG_URLS = [
+    "https://abdyasam.blogspot.com/",
+    "https://abdyasam.blogspot.com/search?max-results=20"
+]
+
+def _parse_blog_posts(html):
+    """Extract up to _BLOG_CONTEXT_MAX characters of post text from a blog page."""
+    # The whole page is parsed (with the C-based lxml parser) so that post-like
+    # widgets inside nav/header/footer are dropped along with their ancestors.
+    soup = BeautifulSoup(html, "lxml")
+    for tag in soup(["script", "style", "nav", "header", "footer"]):
+        tag.decompose()
+    parts = []
+    total = 0
+    posts = soup.find_all("div", class_=_POST_CLASS_RE)
+    for p in posts[:15]:
+        text = p.get_text(separator=" ", strip=True)
+        if len(text) > 100:
+            parts.append(text[:800] + "\n---\n")
+            total += len(parts[-1])
+            if total >= _BLOG_CONTEXT_MAX:
+                break
+    return parts
+
+def _fetch_blog_page(url):
+    """Return the post snippets for one blog URL, or None if it could not be fetched."""
+    page = _blog_pages.get(url)
+    headers = dict(_BLOG_HEADERS)
+    if page and page["etag"]:
+        headers["If-None-Match"] = page["etag"]
+    if page and page["last_modified"]:
+        headers["If-Modified-Since"] = page["last_modified"]
+    r = _session.get(url, headers=headers, timeout=8)
+    if r.status_code == 304 and page:
+        return page["parts"]
+    if not r.ok:
+        logger.warning("Blog fetch returned status %s for %s", r.status_code, url)
+        return None
+    parts = _parse_blog_posts(r.content)
+    _blog_pages[url] = {
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "parts": parts,
+    }
+    return parts
+
 def _fetch_blog():
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120 Safari/537.36",
-            "Accept-Language": "en-US,en;q=0.9",
-            "Referer": "https://www.google.com/"
-        }
-        urls = [
-            "https://abdyasam.blogspot.com/",
-            "https://abdyasam.blogspot.com/search?max-results=20"
-        ]
-        combined = ""
-        for url in urls:
-            r = requests.get(url, headers=headers, timeout=8)
-            if not r.ok:
-                logger.warning("Blog fetch returned status %s for %s", r.status_code, url)
+        # Fetch all sources concurrently; results come back in URL order.
+        with ThreadPoolExecutor(max_workers=len(_BLOG_URLS)) as executor:
+            pages = list(executor.map(_fetch_blog_page, _BLOG_URLS))
+        parts = []
+        total = 0
+        for page_parts in pages:
+            if not page_parts:
                 continue
-            soup = BeautifulSoup(r.text, "html.parser")
-            for tag in soup(["script", "style", "nav", "header", "footer"]):
-                tag.decompose()
-            posts = soup.find_all("div", class_=lambda c: c and "post" in c.lower())
-            for p in posts[:15]:
-                text = p.get_text(separator=" ", strip=True)
-                if len(text) > 100:
-                    combined += text[:800] + "\n---\n"
-        if combined:
+            parts.extend(page_parts)
+            total += sum(len(part) for part in page_parts)
+            if total >= _BLOG_CONTEXT_MAX:
+                break
+        if parts:
             with _blog_cache_lock:
-                _blog_cache["content"] = combined[:6000]
+                _blog_cache["content"] = "".join(parts)[:_BLOG_CONTEXT_MAX]
                 _blog_cache["last"] = time.time()
     except requests.RequestException as exc:
         logger.warning("Blog fetch failed (%s); using fallback content", exc.__class__.__name__)
@@ -361,14 +698,24 @@ def _fetch_blog():
             _blog_cache["content"] = FALLBACK
 
 def _bg_refresh():
-    while True:
+    while not _refresh_stop.is_set():
         try:
             _fetch_blog()
         except Exception:
             logger.exception("Unexpected error in background blog refresh")
-        time.sleep(3600)
+        # Set early to refresh now (or, with _refresh_stop, to exit the loop)
+        _refresh_event.wait(timeout=_BLOG_REFRESH_INTERVAL + random.uniform(-_BLOG_REFRESH_JITTER, _BLOG_REFRESH_JITTER))
+        _refresh_event.clear()
+
+def _stop_bg_refresh():
+    _refresh_stop.set()
+    _refresh_event.set()
 
+@app.before_request
 def ensure_bg_refresh_started():
+    # Started in the processes that serve requests: at fork in preloaded gunicorn
+    # workers (see _restart_bg_refresh), otherwise on the first request. A
+    # preloaded master never serves, so it doesn't fetch or refresh at all.
     global _refresh_thread_started
     if _refresh_thread_started:
         return
@@ -376,8 +723,20 @@ def ensure_bg_refresh_started():
         if _refresh_thread_started:
             return
         threading.Thread(target=_bg_refresh, daemon=True).start()
+        atexit.register(_stop_bg_refresh)
         _refresh_thread_started = True
 
+def _restart_bg_refresh():
+    # Start fetching as soon as a worker is forked (gunicorn --preload) rather
+    # than on its first request, with state that can't hold a parent's locks.
+    global _refresh_thread_started, _refresh_thread_lock, _refresh_event, _refresh_stop, _blog_cache_lock
+    _blog_cache_lock = threading.Lock()
+    _refresh_thread_lock = threading.Lock()
+    _refresh_event = threading.Event()
+    _refresh_stop = threading.Event()
+    _refresh_thread_started = False
+    ensure_bg_refresh_started()
+
 def get_context():
     with _blog_cache_lock:
         content = _blog_cache["content"]
@@ -453,6 +812,29 @@ def local_fallback_reply(user=None):
         "If the issue persists, please use the Feedback tab to let us know."
     )
 
+def _build_unsafe_char_re():
+    """Compile a character class of every non-ASCII code point in Unicode category C*."""
+    ranges = []
+    start = None
+    for cp in range(128, sys.maxunicode + 1):
+        unsafe = unicodedata.category(chr(cp))[0] == 'C'
+        if unsafe and start is None:
+            start = cp
+        elif not unsafe and start is not None:
+            ranges.append((start, cp - 1))
+            start = None
+    if start is not None:
+        ranges.append((start, sys.maxunicode))
+    parts = [
+        re.escape(chr(lo)) if lo == hi else f'{re.escape(chr(lo))}-{re.escape(chr(hi))}'
+        for lo, hi in ranges
+    ]
+    return re.compile('[' + ''.join(parts) + ']')
+
+# Built once at import so filtering runs inside the C regex engine rather
+# than as a per-character Python loop.
+_UNSAFE_CHAR_RE = _build_unsafe_char_re()
+
 def _clean_ai_text(text):
     """Remove markdown formatting and filter to safe Unicode characters."""
     text = text.replace('**', '')
@@ -460,14 +842,13 @@ def _clean_ai_text(text):
     text = re.sub(r'(?m)^#+\s*', '', text)
     # Normalize excessive blank lines (3+ newlines → 2)
     text = re.sub(r'\n{3,}', '\n\n', text)
-    cleaned = []
-    for c in text:
-        if ord(c) < 128 or unicodedata.category(c).startswith(('L', 'M', 'N', 'P', 'S', 'Z')):
-            cleaned.append(c)
-    return ''.join(cleaned).strip()
-
-def llm(system, user):
-    usa_prompt = """
+    # Keep ASCII plus letters, marks, numbers, punctuation, symbols and separators;
+    # pure-ASCII text (an O(1) check on CPython) has nothing to filter.
+    if not text.isascii():
+        text = _UNSAFE_CHAR_RE.sub('', text)
+    return text.strip()
+
+_USA_PROMPT = """
     🇺🇸 ALL RESPONSES MUST BE IN ENGLISH ONLY. DO NOT use any other language. Do not include Turkish or any non-English text.
     🇺🇸 ONLY ANSWER ABOUT USA-RELATED TOPICS
     ✅ USA VISA / SSN / BANK / HOUSING / UBER / TAX / HEALTH
@@ -495,15 +876,22 @@ def llm(system, user):
     ⚠️ USA / NJ / NY ONLY!
     """
 
-    full_system = system + "\n\n" + usa_prompt + "\n\nReference data:\n" + get_context()
+@lru_cache(maxsize=32)
+def _build_full_system(system, context):
+    # Keyed on the context string itself: it only changes when the blog cache
+    # is refreshed, and str caches its own hash so lookups stay cheap.
+    return system + "\n\n" + _USA_PROMPT + "\n\nReference data:\n" + context
 
-    key = _cache_key(system, user)
-    cached = _response_cache_get(key)
-    if cached is not None:
-        return cached
+# Identical prompts already being answered, keyed like the response cache;
+# concurrent duplicates wait on the first caller instead of calling out again.
+_inflight: 'dict[str, Future]' = {}
+_inflight_lock = threading.Lock()
+
+def _generate(key, system, user, providers):
+    full_system = _build_full_system(system, get_context())
 
     text = ''
-    for provider in _PROVIDERS:
+    for provider in providers:
         text = provider(full_system, user)
         if text:
             break
@@ -515,14 +903,104 @@ def llm(system, user):
     _response_cache_set(key, result)
     return result
 
+def llm(system, user, providers=_PROVIDERS):
+    key = _cache_key(system, user)
+    cached = _response_cache_get(key)
+    if cached is not None:
+        return cached
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            leader = False
+        else:
+            # The previous leader may have finished since the cache check
+            cached = _response_cache_get(key)
+            if cached is not None:
+                return cached
+            leader = True
+            future = _inflight[key] = Future()
+    if not leader:
+        return future.result()
+
+    try:
+        result = _generate(key, system, user, providers)
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+# ─── WARM-UP ──────────────────────────────────────────
+# With WARMUP_ENABLED=1, a background thread sends a tiny prompt through the
+# provider chain when a process serves its first request and every few minutes
+# after, so a question after an idle spell doesn't pay for a cold provider or
+# a fresh TLS handshake.
+# It bypasses llm(): the response cache would swallow repeat pings, and the
+# full system prompt would spend thousands of tokens on each one.
+_WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', '') == '1'
+_WARMUP_INTERVAL = 240  # seconds
+_warmup_stop = threading.Event()
+_warmup_started = False
+_warmup_lock = threading.Lock()
+
+def _warmup_ping():
+    for provider in _PROVIDERS:
+        if provider("Reply with the single word: ok", "ping"):
+            return True
+    return False
+
+def _warmup_loop():
+    while not _warmup_stop.is_set():
+        try:
+            if not _warmup_ping():
+                logger.info("Warm-up ping got no provider response")
+        except Exception:
+            logger.exception("Unexpected error in warm-up ping")
+        _warmup_stop.wait(timeout=_WARMUP_INTERVAL)
+
+def _stop_warmup():
+    _warmup_stop.set()
+
+@app.before_request
+def ensure_warmup_started():
+    # Started lazily so it only runs in processes that serve requests (a worker's
+    # pooled connections are the ones worth keeping warm), never in a preloaded
+    # gunicorn master.
+    global _warmup_started
+    if _warmup_started or not _WARMUP_ENABLED:
+        return
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        threading.Thread(target=_warmup_loop, daemon=True).start()
+        atexit.register(_stop_warmup)
+        _warmup_started = True
+
 
 class BadRequestError(Exception):
     """Raised when the request body is not in the expected format."""
 
 
 _MAX_FIELD_LENGTH = 2000
+_MAX_CONTENT_LENGTH = 16 * 1024  # bytes; every form fits well within this
+
+app.config['MAX_CONTENT_LENGTH'] = _MAX_CONTENT_LENGTH
+
+def require_json(required_fields=None, list_fields=()):
+    """Return the JSON body as a dict of plain string/number fields.
+
+    Fields named in list_fields may instead hold a list; the route validates its items.
+    """
+    # Reject oversized bodies before reading or parsing them.
+    if request.content_length and request.content_length > _MAX_CONTENT_LENGTH:
+        raise BadRequestError(f"Request body exceeds maximum size ({_MAX_CONTENT_LENGTH} bytes).")
 
-def require_json(required_fields=None):
     data = request.get_json(silent=True)
     if not isinstance(data, dict):
         raise BadRequestError("JSON body required.")
@@ -533,6 +1011,10 @@ def require_json(required_fields=None):
         raise BadRequestError(f"Missing field(s): {', '.join(missing)}")
 
     for key, value in data.items():
+        if key in list_fields and isinstance(value, list):
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise BadRequestError(f"Field '{key}' must be a string or number.")
         if isinstance(value, str) and len(value) > _MAX_FIELD_LENGTH:
             raise BadRequestError(f"Request field exceeds maximum length ({_MAX_FIELD_LENGTH} characters).")
 
@@ -546,9 +1028,27 @@ def handle_bad_request(error):
     logger.warning("Bad request: %s", error)
     return jsonify(error=str(error)), 400
 
+# Full tracebacks are expensive to format; during a burst of the same error,
+# log only the exception type after the first few.
+_TRACEBACK_LOG_MAX = 10
+_TRACEBACK_LOG_WINDOW = 60       # seconds
+_traceback_log_times: 'defaultdict[type, deque]' = defaultdict(lambda: deque(maxlen=_TRACEBACK_LOG_MAX))
+_traceback_log_lock = threading.Lock()
+
+def _should_log_traceback(exc_type) -> bool:
+    now = time.time()
+    with _traceback_log_lock:
+        q = _traceback_log_times[exc_type]
+        burst = len(q) == _TRACEBACK_LOG_MAX and now - q[0] < _TRACEBACK_LOG_WINDOW
+        q.append(now)
+        return not burst
+
 @app.errorhandler(Exception)
-def handle_unexpected_error(_error):
-    logger.exception("Unhandled exception")
+def handle_unexpected_error(error):
+    if _should_log_traceback(type(error)):
+        logger.exception("Unhandled exception")
+    else:
+        logger.error("Unhandled exception (traceback suppressed): %s", type(error).__name__)
     return jsonify(error="An error occurred during processing."), 500
 
 # ─── HTML ─────────────────────────────────────────────
@@ -908,6 +1408,66 @@ async function call(endpoint,data,outId,btnId,label){
   }
 }
 
+async function callStream(endpoint,data,outId,btnId,label){
+  const out=document.getElementById(outId);
+  const btn=document.getElementById(btnId);
+  btn.disabled=true;
+  btn.innerHTML='<span class="spinner"></span> Loading...';
+  out.classList.remove('error');
+  out.classList.add('loading');
+  out.textContent='Generating your guide...';
+  try{
+    const r=await fetch(endpoint,{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(data)});
+    if(!r.ok || !r.body){
+      const j=await r.json().catch(()=>({}));
+      out.classList.remove('loading');
+      out.classList.add('error');
+      out.textContent='⚠️ Error: '+(j.error || 'Request could not be processed.');
+      return;
+    }
+    // Server-sent events: text deltas as they are generated, then a final "done" event with the cleaned answer
+    const reader=r.body.getReader();
+    const decoder=new TextDecoder();
+    let buffer='',text='';
+    for(;;){
+      const {done,value}=await reader.read();
+      if(done) break;
+      buffer+=decoder.decode(value,{stream:true});
+      let sep;
+      while((sep=buffer.indexOf('\\n\\n'))>=0){
+        const block=buffer.slice(0,sep);
+        buffer=buffer.slice(sep+2);
+        const line=block.split('\\n').find(l=>l.startsWith('data: '));
+        if(!line) continue;
+        const payload=JSON.parse(line.slice(6));
+        const chunk=payload.text||'';
+        out.classList.remove('loading');
+        if(/^event: error$/m.test(block)){
+          out.classList.add('error');
+          out.textContent=(text ? text+'\\n\\n' : '')+'⚠️ Error: '+(payload.error || 'Request could not be processed.');
+          return;
+        }
+        if(/^event: done$/m.test(block)){
+          out.innerHTML=formatResult(chunk || 'Could not generate result.');
+          return;
+        }
+        text+=chunk;
+        out.textContent=text;
+      }
+    }
+    out.classList.remove('loading');
+    if(!text) out.textContent='Could not generate result.';
+  }catch(e){
+    out.classList.remove('loading');
+    out.classList.add('error');
+    out.textContent='⚠️ Connection error: '+e.message;
+  }finally{
+    btn.disabled=false;
+    btn.textContent=label;
+    out.scrollIntoView({behavior:'smooth',block:'nearest'});
+  }
+}
+
 const ACTIONS = {
   visa: () => call('/visa',{type:g('v1'),state:g('v2'),situation:g('v3')},'vo','vb','Generate Visa Plan'),
   tax: () => call('/tax',{form:g('t1'),income:g('t2'),visa:g('t3'),state:g('t4')},'to','tb','Generate Tax Checklist'),
@@ -921,7 +1481,7 @@ const ACTIONS = {
   car: () => call('/car',{state:g('ar1'),topic:g('ar2')},'aro','arb','Car Guide'),
   transfer: () => call('/transfer',{topic:g('w1')},'wo','wb','Money Transfer Guide'),
   flights: () => call('/flights',{airline:g('u1'),topic:g('u2')},'uo','ub','Flight Guide'),
-  ask: () => call('/ask',{question:g('q1')},'qo','qb','Answer')
+  ask: () => callStream('/ask_stream',{question:g('q1')},'qo','qb','Answer')
 };
 
 document.addEventListener('DOMContentLoaded', () => {
@@ -954,11 +1514,83 @@ document.addEventListener('DOMContentLoaded', () => {
 
 </script>
 </body>
-</html>"""# ─── ROUTES ──────────────────────────────────────────
+</html>"""
+
+# The page is fully static, so encode, compress and hash it once at import.
+_HTML_BYTES = HTML.encode('utf-8')
+_HTML_BR = brotli.compress(_HTML_BYTES, quality=11)
+_HTML_GZ = gzip.compress(_HTML_BYTES, compresslevel=9)
+_HTML_ETAG = hashlib.md5(_HTML_BYTES).hexdigest()
+_HTML_CACHE_CONTROL = 'public, max-age=300'
+
+# ─── PROMPTS ─────────────────────────────────────────
+# Per-route system prompts and user templates. Fields missing from the request
+# render as empty strings unless the route passes an explicit default.
+_VISA_SYSTEM = "You are a US immigration expert. Provide practical English guidance."
+_VISA_TEMPLATE = "{type} visa. State: {state}. Situation: {situation}. Documents, forms, fees, common mistakes, links."
+
+_TAX_SYSTEM = "You are a US tax expert. Explain clearly in English."
+_TAX_TEMPLATE = "Form: {form}. Income: ${income}. Visa: {visa}. State: {state}. Filing guide, refund estimate, deadlines."
+
+_RIDESHARE_SYSTEM = "You are a rideshare and gig economy expert. Write in English."
+_RIDESHARE_TEMPLATE = "{app} - {state}. Topic: {topic}. Documents, earnings, tax, tips."
+
+_HOUSING_SYSTEM = "You are a US real estate expert. Write in English."
+_HOUSING_TEMPLATE = "{city} ${budget} budget. Situation: {situation}. Websites, documents, negotiation tips."
+
+_HEALTH_SYSTEM = "You are a US healthcare system expert. Write practical English guidance."
+_HEALTH_TEMPLATE = "{state} - {situation}. Addresses, documents, Medicaid, free clinics."
+
+_LICENSE_SYSTEM = "You are a US DMV expert. Explain in English."
+_LICENSE_TEMPLATE = "{state} driver's license: {situation}. 6 Points documents, exam, appointment, fees."
+
+_SSN_SYSTEM = "You are a US SSN expert. Provide practical English guidance focused on NJ."
+_SSN_TEMPLATE = (
+    "Visa: {visa}. State: {state}. Situation: {situation}. "
+    "Required documents for SSN, application steps, NJ SSA office addresses, "
+    "CPT/OPT requirements for F-1/J-1, ITIN alternative, common mistakes."
+)
+
+_BANK_SYSTEM = "You are a US banking expert. Write in English."
+_BANK_TEMPLATE = "Topic: {situation}. Which bank, documents, credit score, secured card."
+
+_PHONE_SYSTEM = "You are a US telecom expert. Provide an English guide."
+_PHONE_TEMPLATE = "Topic: {topic}. Step-by-step setup, prices, alternatives."
+
+_CAR_SYSTEM = "You are a US automotive expert. Write in English."
+_CAR_TEMPLATE = "{state} - {topic}. Documents, insurance, pricing, CarMax/Carvana."
+
+_TRANSFER_SYSTEM = "You are a money transfer expert. Explain in English."
+_TRANSFER_TEMPLATE = "Topic: {topic}. Steps, fees, limits, alternatives."
+
+_FLIGHTS_SYSTEM = "You are an aviation expert. Provide a practical English guide."
+_FLIGHTS_TEMPLATE = "{airline} - {topic}. Detailed info, fees, tips."
+
+_ASK_SYSTEM = "You are a practical guide expert for people living in the USA. Give clear, step-by-step, safe answers in English."
+
+def _render_prompt(template, data, **defaults):
+    return template.format_map(defaultdict(str, {**defaults, **data}))
+
+# ─── ROUTES ──────────────────────────────────────────
 @app.route('/')
 def index():
-    response = make_response(HTML)
-    response.headers['Content-Type'] = 'text/html'
+    encoding = request.accept_encodings.best_match(['br', 'gzip'])
+    if encoding == 'br':
+        body, etag = _HTML_BR, _HTML_ETAG + '-br'
+    elif encoding == 'gzip':
+        body, etag = _HTML_GZ, _HTML_ETAG + '-gzip'
+    else:
+        body, etag = _HTML_BYTES, _HTML_ETAG
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(body)
+        response.mimetype = 'text/html'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = _HTML_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
     return response
 
 @app.route('/healthz')
@@ -974,127 +1606,203 @@ def healthz():
 
 @app.route('/visa', methods=['POST'])
 def do_visa():
-    d = require_json(["type"])
-    return llm_json(
-        "You are a US immigration expert. Provide practical English guidance.",
-        f"{d['type']} visa. State: {d.get('state','')}. Situation: {d.get('situation','')}. Documents, forms, fees, common mistakes, links."
-    )
+    return llm_json(_VISA_SYSTEM, _render_prompt(_VISA_TEMPLATE, require_json(["type"])))
 
 @app.route('/tax', methods=['POST'])
 def do_tax():
-    d = require_json(["form"])
-    return llm_json(
-        "You are a US tax expert. Explain clearly in English.",
-        f"Form: {d['form']}. Income: ${d.get('income',0)}. Visa: {d.get('visa','')}. State: {d.get('state','')}. Filing guide, refund estimate, deadlines."
-    )
+    return llm_json(_TAX_SYSTEM, _render_prompt(_TAX_TEMPLATE, require_json(["form"]), income=0))
 
 @app.route('/rideshare', methods=['POST'])
 def do_rideshare():
-    d = require_json(["app"])
-    return llm_json(
-        "You are a rideshare and gig economy expert. Write in English.",
-        f"{d['app']} - {d.get('state','')}. Topic: {d.get('topic','')}. Documents, earnings, tax, tips."
-    )
+    return llm_json(_RIDESHARE_SYSTEM, _render_prompt(_RIDESHARE_TEMPLATE, require_json(["app"])))
 
 @app.route('/housing', methods=['POST'])
 def do_housing():
-    d = require_json()
-    return llm_json(
-        "You are a US real estate expert. Write in English.",
-        f"{d.get('city','')} ${d.get('budget','')} budget. Situation: {d.get('situation','')}. Websites, documents, negotiation tips."
-    )
+    return llm_json(_HOUSING_SYSTEM, _render_prompt(_HOUSING_TEMPLATE, require_json()))
 
 @app.route('/health', methods=['POST'])
 def do_health():
-    d = require_json()
-    return llm_json(
-        "You are a US healthcare system expert. Write practical English guidance.",
-        f"{d.get('state','')} - {d.get('situation','')}. Addresses, documents, Medicaid, free clinics."
-    )
+    return llm_json(_HEALTH_SYSTEM, _render_prompt(_HEALTH_TEMPLATE, require_json()))
 
 @app.route('/license', methods=['POST'])
 def do_license():
-    d = require_json()
-    return llm_json(
-        "You are a US DMV expert. Explain in English.",
-        f"{d.get('state','')} driver's license: {d.get('situation','')}. 6 Points documents, exam, appointment, fees."
-    )
+    return llm_json(_LICENSE_SYSTEM, _render_prompt(_LICENSE_TEMPLATE, require_json()))
 
 @app.route('/ssn', methods=['POST'])
 def do_ssn():
-    d = require_json(["visa"])
-    return llm_json(
-        "You are a US SSN expert. Provide practical English guidance focused on NJ.",
-        f"Visa: {d['visa']}. State: {d.get('state','NJ')}. Situation: {d.get('situation','')}. \
-        Required documents for SSN, application steps, NJ SSA office addresses, \
-        CPT/OPT requirements for F-1/J-1, ITIN alternative, common mistakes."
-    )
+    return llm_json(_SSN_SYSTEM, _render_prompt(_SSN_TEMPLATE, require_json(["visa"]), state='NJ'))
 
 @app.route('/bank', methods=['POST'])
 def do_bank():
-    d = require_json()
-    return llm_json(
-        "You are a US banking expert. Write in English.",
-        f"Topic: {d.get('situation','')}. Which bank, documents, credit score, secured card."
-    )
+    return llm_json(_BANK_SYSTEM, _render_prompt(_BANK_TEMPLATE, require_json()))
 
 @app.route('/phone', methods=['POST'])
 def do_phone():
-    d = require_json()
-    return llm_json(
-        "You are a US telecom expert. Provide an English guide.",
-        f"Topic: {d.get('topic','')}. Step-by-step setup, prices, alternatives."
-    )
+    return llm_json(_PHONE_SYSTEM, _render_prompt(_PHONE_TEMPLATE, require_json()))
 
 @app.route('/car', methods=['POST'])
 def do_car():
-    d = require_json()
-    return llm_json(
-        "You are a US automotive expert. Write in English.",
-        f"{d.get('state','')} - {d.get('topic','')}. Documents, insurance, pricing, CarMax/Carvana."
-    )
+    return llm_json(_CAR_SYSTEM, _render_prompt(_CAR_TEMPLATE, require_json()))
 
 @app.route('/transfer', methods=['POST'])
 def do_transfer():
-    d = require_json()
-    return llm_json(
-        "You are a money transfer expert. Explain in English.",
-        f"Topic: {d.get('topic','')}. Steps, fees, limits, alternatives."
-    )
+    return llm_json(_TRANSFER_SYSTEM, _render_prompt(_TRANSFER_TEMPLATE, require_json()))
 
 @app.route('/flights', methods=['POST'])
 def do_flights():
-    d = require_json()
-    return llm_json(
-        "You are an aviation expert. Provide a practical English guide.",
-        f"{d.get('airline','')} - {d.get('topic','')}. Detailed info, fees, tips."
-    )
+    return llm_json(_FLIGHTS_SYSTEM, _render_prompt(_FLIGHTS_TEMPLATE, require_json()))
 
 @app.route('/ask', methods=['POST'])
 def do_ask():
     d = require_json()
-    return llm_json(
-        "You are a practical guide expert for people living in the USA. Give clear, step-by-step, safe answers in English.",
-        d.get('question', '')
+    return llm_json(_ASK_SYSTEM, str(d.get('question', '')))
+
+def _sse_event(data, event=None):
+    prefix = f'event: {event}\n'.encode() if event else b''
+    return prefix + b'data: ' + orjson.dumps(data) + b'\n\n'
+
+def _sse_answer(system, user):
+    """Stream an answer as SSE: raw text deltas, then a final 'done' event with the cleaned
+    result, or an 'error' event if the provider failed partway through."""
+    key = _cache_key(system, user)
+    result = _response_cache_get(key)
+    if result is None:
+        full_system = _build_full_system(system, get_context())
+        parts = []
+        try:
+            for delta in llm_stream(full_system, user):
+                parts.append(delta)
+                yield _sse_event({'text': delta})
+        except StreamInterruptedError:
+            # The partial text is not an answer; don't finish or cache it
+            yield _sse_event({'error': 'The answer was interrupted. Please try again.'}, event='error')
+            return
+        if parts:
+            result = _clean_ai_text(''.join(parts))
+            _response_cache_set(key, result)
+        else:
+            # No streaming provider answered; try the rest of the chain, not them again
+            result = llm(system, user, providers=_NON_STREAM_PROVIDERS)
+    yield _sse_event({'text': result}, event='done')
+
+@app.route('/ask_stream', methods=['POST'])
+def do_ask_stream():
+    d = require_json()
+    return Response(
+        stream_with_context(_sse_answer(_ASK_SYSTEM, str(d.get('question', '')))),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
     )
 
+_MAX_BATCH_QUESTIONS = 5
+# Shared across requests so batch calls don't spin up threads per request
+_batch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ask-batch')
+
+@app.route('/ask_batch', methods=['POST'])
+def do_ask_batch():
+    d = require_json(['questions'], list_fields=('questions',))
+    questions = d['questions']
+    if not isinstance(questions, list) or not 1 <= len(questions) <= _MAX_BATCH_QUESTIONS:
+        raise BadRequestError(f"'questions' must be a list of 1-{_MAX_BATCH_QUESTIONS} questions.")
+    for question in questions:
+        if not isinstance(question, str) or not question.strip():
+            raise BadRequestError("Each question must be a non-empty string.")
+        if len(question) > _MAX_FIELD_LENGTH:
+            raise BadRequestError(f"Request field exceeds maximum length ({_MAX_FIELD_LENGTH} characters).")
+    # check_rate_limit charged this POST as one request; each question is an LLM call
+    ip = request.remote_addr
+    if ip and len(questions) > 1 and _is_rate_limited(ip, cost=len(questions) - 1):
+        return jsonify(error='Too many requests. Please wait before trying again.'), 429
+    # Answer concurrently so the wall time is the slowest call, not the sum
+    results = list(_batch_executor.map(lambda q: llm(_ASK_SYSTEM, q), questions))
+    return jsonify(results=results)
+
+# ─── FEEDBACK ─────────────────────────────────────────
+# Kept in memory by default. With FEEDBACK_FILE set, entries are queued and a
+# background thread appends them as NDJSON in batches (one write per batch).
+_FEEDBACK_FILE = os.environ.get('FEEDBACK_FILE', '')
+_FEEDBACK_BATCH_MAX = 100
+_FEEDBACK_FLUSH_INTERVAL = 1.0   # seconds
 _feedback_store = deque(maxlen=500)
+_feedback_queue = queue.Queue(maxsize=10000)
+_feedback_writer_thread = None
+_feedback_writer_lock = threading.Lock()
+_FEEDBACK_STOP = object()        # queued at exit; the writer flushes its batch and returns
+
+def _write_feedback_batch(batch):
+    data = b''.join(orjson.dumps(entry) + b'\n' for entry in batch)
+    try:
+        with open(_FEEDBACK_FILE, 'ab') as f:
+            f.write(data)
+    except OSError:
+        logger.exception("Failed to write %d feedback entries", len(batch))
+
+def _feedback_writer():
+    stopping = False
+    while not stopping:
+        entry = _feedback_queue.get()
+        if entry is _FEEDBACK_STOP:
+            return
+        batch = [entry]
+        deadline = time.monotonic() + _FEEDBACK_FLUSH_INTERVAL
+        while len(batch) < _FEEDBACK_BATCH_MAX:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                entry = _feedback_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is _FEEDBACK_STOP:
+                stopping = True
+                break
+            batch.append(entry)
+        _write_feedback_batch(batch)
+
+def _stop_feedback_writer():
+    # Let the writer finish the batch it holds and everything queued before the
+    # stop marker; a daemon thread would otherwise be killed mid-batch at exit.
+    try:
+        _feedback_queue.put(_FEEDBACK_STOP, timeout=5)
+    except queue.Full:
+        logger.warning("Feedback queue full at shutdown; some entries may be lost")
+    _feedback_writer_thread.join(timeout=10)
+
+def ensure_feedback_writer_started():
+    # Started lazily so it runs in the worker that receives feedback, not a preloaded master
+    global _feedback_writer_thread
+    if _feedback_writer_thread is not None:
+        return
+    with _feedback_writer_lock:
+        if _feedback_writer_thread is not None:
+            return
+        thread = threading.Thread(target=_feedback_writer, daemon=True)
+        thread.start()
+        atexit.register(_stop_feedback_writer)
+        _feedback_writer_thread = thread
 
 @app.route('/feedback', methods=['POST'])
 def do_feedback():
     d = require_json(['message'])
-    message = d.get('message', '').strip()
+    message = str(d.get('message', '')).strip()
     if not message:
         raise BadRequestError("Message cannot be empty.")
-    _feedback_store.append({
+    entry = {
         'message': message,
-        'contact': d.get('contact', '').strip(),
+        'contact': str(d.get('contact', '')).strip(),
         'ts': int(time.time())
-    })
+    }
+    if _FEEDBACK_FILE:
+        ensure_feedback_writer_started()
+        try:
+            _feedback_queue.put_nowait(entry)
+        except queue.Full:
+            logger.warning("Feedback queue full; dropping entry")
+    else:
+        _feedback_store.append(entry)
     return jsonify(result='Thank you! Your feedback has been received.')
 
-# Ensure background refresh starts on import (for gunicorn)
-ensure_bg_refresh_started()
+os.register_at_fork(after_in_child=_restart_bg_refresh)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))